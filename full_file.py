@@ -1,30 +1,195 @@
+import hashlib
+import io
+import logging
 import os
 import time
-import tempfile
+import zlib
 import streamlit as st
 from datetime import datetime
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-import pdfplumber
-import pandas as pd
 import google.generativeai as genai
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.dml.color import RGBColor
-from pptx.enum.text import PP_ALIGN
 import re
-import random
 
 # Load environment variables
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+logger = logging.getLogger(__name__)
 
 MODEL_NAME = "gemini-2.0-flash"
 MAX_PDF_SIZE_MB = 50
 MAX_SLIDES = 10
 PROCESSING_CHUNK_SIZE = 15000
 MIN_CONTENT_LENGTH = 100
+CSV_PREVIEW_ROWS = 20
 PPT_FONT = "Calibri"
+MAX_CHAT_MESSAGES = 100
+KEPT_CHAT_MESSAGES = 40
+COMPRESS_MESSAGES_OVER = 4096
+COMPACT_HISTORY_AFTER = 30
+COMPACT_HISTORY_KEEP = 10
+GEMINI_FILE_TTL = 47 * 60 * 60  # uploaded files expire server-side after 48h
+GEMINI_FILE_CACHE_ENTRIES = 64
+CSV_CACHE_ENTRIES = 32
+CSV_CACHE_TTL = 60 * 60
+PPTX_CACHE_ENTRIES = 32
+PPTX_CACHE_TTL = 60 * 60
+SLIDE_RE = re.compile(r'\*\*Slide \d+:[^\n]*?\*\*(.*?)(?=\*\*Slide \d+:|\Z)', re.S)
+TITLE_RE = re.compile(r'\*\*Title:\*\*\s*(.*)')
+BULLET_RE = re.compile(r'(?m)^[ \t]*\*[ \t]+(?!\*\*(?:Title|Subtitle|Bullet Points):\*\*)(\S.*)')
+
+# ==================== HELPERS =====================
+@st.cache_resource
+def get_model(name=MODEL_NAME):
+    return genai.GenerativeModel(model_name=name)
+
+def _extract_text_pdfplumber(data):
+    # Serial on purpose: ~90% of the time is pdfminer parsing under the GIL, so threads don't help.
+    # Pages are only laid out when extract_text runs, so stopping early bounds the work.
+    import pdfplumber
+    text = ""
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for i, page in enumerate(pdf.pages):
+            page_text = page.extract_text()
+            if page_text:
+                text += f"\n\n[Page {i+1}]\n{page_text}"
+            if len(text) > PROCESSING_CHUNK_SIZE:
+                break
+    return text
+
+def _extract_text_pdfium(data):
+    # pdfium reads the text layer directly, skipping pdfminer's layout analysis.
+    import pypdfium2 as pdfium
+    text = ""
+    pdf = pdfium.PdfDocument(data)
+    try:
+        for i, page in enumerate(pdf):
+            textpage = page.get_textpage()
+            page_text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+            if page_text:
+                text += f"\n\n[Page {i+1}]\n{page_text}"
+            if len(text) > PROCESSING_CHUNK_SIZE:
+                break
+    finally:
+        pdf.close()
+    return text
+
+def extract_pdf_text(pdf_file):
+    data = pdf_file.getvalue()
+    try:
+        return _extract_text_pdfium(data)
+    except Exception:
+        return _extract_text_pdfplumber(data)
+
+def _hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _wait_ready(file, initial=0.2, cap=2.0, mult=1.7):
+    delay = initial
+    while file.state.name == "PROCESSING":
+        time.sleep(delay)
+        delay = min(cap, delay * mult)
+        file = genai.get_file(file.name)
+    return file
+
+@st.cache_resource(show_spinner=False, max_entries=GEMINI_FILE_CACHE_ENTRIES, ttl=GEMINI_FILE_TTL)
+def _get_gemini_file(content_hash, _data, mime_type, _display_name):
+    file = _wait_ready(genai.upload_file(io.BytesIO(_data), mime_type=mime_type, display_name=_display_name))
+    if file.state.name == "FAILED":
+        raise ValueError(f"Gemini could not process {_display_name}.")
+    return file
+
+@st.cache_data(show_spinner=False, max_entries=CSV_CACHE_ENTRIES, ttl=CSV_CACHE_TTL)
+def _summarize_csv(content_hash, _data):
+    # Only the preview and schema are kept; Gemini already has the full file.
+    import pandas as pd
+    try:
+        df = pd.read_csv(io.BytesIO(_data), engine="pyarrow", dtype_backend="pyarrow")
+    except Exception:
+        df = pd.read_csv(io.BytesIO(_data))
+    return df.head(CSV_PREVIEW_ROWS), df.dtypes.astype(str).to_dict()
+
+def _append_message(messages, role, content):
+    if len(content) > COMPRESS_MESSAGES_OVER:
+        messages.append({"role": role, "content": zlib.compress(content.encode()), "_z": True})
+    else:
+        messages.append({"role": role, "content": content})
+    if len(messages) > MAX_CHAT_MESSAGES:
+        truncated = sum(m.get("truncated", 1) for m in messages[:-KEPT_CHAT_MESSAGES])
+        messages[:] = [{
+            "role": "assistant",
+            "content": f"[{truncated} earlier messages truncated]",
+            "truncated": truncated
+        }] + messages[-KEPT_CHAT_MESSAGES:]
+
+def _message_content(msg):
+    return zlib.decompress(msg["content"]).decode() if msg.get("_z") else msg["content"]
+
+def _compact_history(chat, keep_last=COMPACT_HISTORY_KEEP):
+    # Fold older turns into one summary so each send_message stops resending the whole transcript.
+    # The first turn carries the uploaded file and instructions, so it is always kept.
+    history = chat.history
+    if len(history) <= COMPACT_HISTORY_AFTER:
+        return
+    primer, older, recent = history[:1], history[1:-keep_last], history[-keep_last:]
+    transcript = "\n".join(
+        f"{content.role}: {' '.join(part.text for part in content.parts if part.text)}"
+        for content in older
+    )
+    try:
+        summary = get_model().generate_content(f"""
+Summarize the conversation below so it can replace the original turns as context.
+Collapse multi-bullet narratives into <=2 sentences, keep concrete facts, figures and open questions,
+and target under 1500 chars.
+CONVERSATION:
+{transcript}
+""").text
+    except Exception:
+        # A failed summary must not block the user's message; send with the full history instead.
+        logger.warning("Chat history compaction failed; keeping full history", exc_info=True)
+        return
+    chat.history = primer + [
+        {"role": "user", "parts": [f"HISTORY_SUMMARY:\n{summary}"]},
+        {"role": "model", "parts": ["Acknowledged."]}
+    ] + recent
+
+@st.cache_data(show_spinner=False, max_entries=PPTX_CACHE_ENTRIES, ttl=PPTX_CACHE_TTL)
+def _build_pptx(title, structure, date_str):
+    from pptx import Presentation
+    from pptx.util import Inches, Pt
+    from pptx.dml.color import RGBColor
+    from pptx.enum.text import PP_ALIGN
+    # Style values are built once per deck, outside the bullet loop.
+    bullet_size = Pt(18)
+    bullet_color = RGBColor(0, 0, 0)
+    prs = Presentation()
+    prs.slide_width = Inches(13.333)
+    prs.slide_height = Inches(7.5)
+    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    slide.shapes.title.text = title
+    slide.placeholders[1].text = f"Generated on {date_str}"
+
+    for i, match in enumerate(SLIDE_RE.finditer(structure)):
+        content = match.group(1)
+        title_match = TITLE_RE.search(content)
+        slide_title = title_match.group(1).strip() if title_match else f"Slide {i+2}"
+        bullets = BULLET_RE.findall(content)
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = slide_title
+        text_frame = slide.placeholders[1].text_frame
+        text_frame.clear()
+        for bullet in bullets:
+            para = text_frame.add_paragraph()
+            para.text = bullet
+            para.font.size = bullet_size
+            para.font.color.rgb = bullet_color
+            para.font.name = PPT_FONT
+            para.alignment = PP_ALIGN.LEFT
+
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
 
 # ==================== NAVIGATION =====================
 st.set_page_config(page_title="AI Utilities", page_icon="🤖")
@@ -40,26 +205,23 @@ def pdf_chat():
     if "pdf_chat" not in st.session_state:
         st.session_state.pdf_chat = {
             "messages": [],
-            "file_processed": False,
+            "file_hash": None,
             "gemini_file": None,
             "chat_session": None
         }
 
-    if uploaded_file and not st.session_state.pdf_chat["file_processed"]:
+    data = uploaded_file.getvalue() if uploaded_file else None
+    content_hash = _hash_bytes(data) if data else None
+    if content_hash and content_hash != st.session_state.pdf_chat["file_hash"]:
         with st.spinner("Processing your PDF..."):
             try:
-                with open("temp_upload.pdf", "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                file = genai.upload_file("temp_upload.pdf", mime_type="application/pdf")
-                while file.state.name == "PROCESSING":
-                    time.sleep(2)
-                    file = genai.get_file(file.name)
-                chat = genai.GenerativeModel(model_name=MODEL_NAME).start_chat(history=[{
+                file = _get_gemini_file(content_hash, data, "application/pdf", uploaded_file.name)
+                chat = get_model().start_chat(history=[{
                     "role": "user",
                     "parts": [file, "You are a PDF analysis assistant..."]
                 }])
                 st.session_state.pdf_chat.update({
-                    "file_processed": True,
+                    "file_hash": content_hash,
                     "gemini_file": file,
                     "chat_session": chat,
                     "messages": [{"role": "assistant", "content": "Hi! Ready to help with your PDF."}]
@@ -70,20 +232,21 @@ def pdf_chat():
 
     for msg in st.session_state.pdf_chat["messages"]:
         with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
+            st.markdown(_message_content(msg))
 
     if prompt := st.chat_input("Ask about the PDF..."):
-        st.session_state.pdf_chat["messages"].append({"role": "user", "content": prompt})
+        _append_message(st.session_state.pdf_chat["messages"], "user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
         with st.chat_message("assistant"):
             with st.spinner("Analyzing..."):
                 try:
-                    response = st.session_state.pdf_chat["chat_session"].send_message(prompt)
-                    st.markdown(response.text)
+                    _compact_history(st.session_state.pdf_chat["chat_session"])
+                    response_text = st.session_state.pdf_chat["chat_session"].send_message(prompt).text
                 except Exception as e:
-                    st.markdown(f"Error: {str(e)}")
-        st.session_state.pdf_chat["messages"].append({"role": "assistant", "content": response.text})
+                    response_text = f"Error: {str(e)}"
+                st.markdown(response_text)
+        _append_message(st.session_state.pdf_chat["messages"], "assistant", response_text)
 
 # ==================== CSV CHAT =====================
 def csv_chat():
@@ -93,77 +256,80 @@ def csv_chat():
     if "csv_chat" not in st.session_state:
         st.session_state.csv_chat = {
             "messages": [],
-            "file_processed": False,
+            "file_hash": None,
             "gemini_file": None,
             "chat_session": None,
-            "df": None
+            "df_preview": None,
+            "df_schema": None
         }
 
-    if uploaded_file and not st.session_state.csv_chat["file_processed"]:
+    data = uploaded_file.getvalue() if uploaded_file else None
+    content_hash = _hash_bytes(data) if data else None
+    if content_hash and content_hash != st.session_state.csv_chat["file_hash"]:
         with st.spinner("Processing your CSV file..."):
             try:
-                df = pd.read_csv(uploaded_file)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
-                    df.to_csv(tmp.name, index=False)
-                    tmp_path = tmp.name
-                file = genai.upload_file(tmp_path, mime_type="text/csv")
-                while file.state.name == "PROCESSING":
-                    time.sleep(2)
-                    file = genai.get_file(file.name)
-                chat = genai.GenerativeModel(model_name=MODEL_NAME).start_chat(history=[{
+                df_preview, df_schema = _summarize_csv(content_hash, data)
+                file = _get_gemini_file(content_hash, data, "text/csv", uploaded_file.name)
+                chat = get_model().start_chat(history=[{
                     "role": "user",
                     "parts": [file, "You are a data assistant..."]
                 }])
                 st.session_state.csv_chat.update({
-                    "file_processed": True,
+                    "file_hash": content_hash,
                     "gemini_file": file,
                     "chat_session": chat,
-                    "df": df,
+                    "df_preview": df_preview,
+                    "df_schema": df_schema,
                     "messages": [{"role": "assistant", "content": "Hi! I have loaded your CSV file."}]
                 })
                 st.rerun()
             except Exception as e:
                 st.error(str(e))
 
-    if st.session_state.csv_chat["df"] is not None:
+    if st.session_state.csv_chat["df_preview"] is not None:
         if st.checkbox("Show Data Preview"):
-            st.dataframe(st.session_state.csv_chat["df"].head())
+            st.dataframe(st.session_state.csv_chat["df_preview"])
+            st.caption(", ".join(f"{col}: {dtype}" for col, dtype in st.session_state.csv_chat["df_schema"].items()))
 
     for msg in st.session_state.csv_chat["messages"]:
         with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
+            st.markdown(_message_content(msg))
 
     if prompt := st.chat_input("Ask about your data..."):
-        st.session_state.csv_chat["messages"].append({"role": "user", "content": prompt})
+        _append_message(st.session_state.csv_chat["messages"], "user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
         with st.chat_message("assistant"):
             with st.spinner("Analyzing..."):
                 try:
-                    response = st.session_state.csv_chat["chat_session"].send_message(prompt)
-                    st.markdown(response.text)
+                    _compact_history(st.session_state.csv_chat["chat_session"])
+                    response_text = st.session_state.csv_chat["chat_session"].send_message(prompt).text
                 except Exception as e:
-                    st.markdown(f"Error: {str(e)}")
-        st.session_state.csv_chat["messages"].append({"role": "assistant", "content": response.text})
+                    response_text = f"Error: {str(e)}"
+                st.markdown(response_text)
+        _append_message(st.session_state.csv_chat["messages"], "assistant", response_text)
 
 # ==================== PPT FROM PDF =====================
 def ppt_from_pdf():
     st.header("📊 PDF to PowerPoint Converter")
-    model = genai.GenerativeModel(model_name=MODEL_NAME)
+    model = get_model()
     pdf_file = st.file_uploader("Upload a PDF", type=["pdf"])
 
+    if "ppt_from_pdf" not in st.session_state:
+        st.session_state.ppt_from_pdf = {
+            "slide_structure": None,
+            "ppt_title": None,
+            "source_hash": None,
+            "generated_on": None
+        }
+
     if pdf_file:
         with st.spinner("Extracting text..."):
             text = ""
             try:
-                with pdfplumber.open(pdf_file) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += f"\n\n[Page {i+1}]\n{page_text}"
-                        if len(text) > PROCESSING_CHUNK_SIZE:
-                            break
+                text = extract_pdf_text(pdf_file)
             except:
+                from PyPDF2 import PdfReader
                 reader = PdfReader(pdf_file)
                 for page in reader.pages:
                     text += page.extract_text()
@@ -173,9 +339,13 @@ def ppt_from_pdf():
                 st.error("Failed to extract text.")
                 return
 
-        ppt_title = st.text_input("Presentation Title", "Business Report")
+        with st.form("ppt_form"):
+            ppt_title = st.text_input("Presentation Title", "Business Report")
+            submitted = st.form_submit_button("Generate Slides")
 
-        if st.button("Generate Slides"):
+        state = st.session_state.ppt_from_pdf
+        source_hash = _hash_bytes(text.encode())
+        if submitted and (state["ppt_title"] != ppt_title or state["source_hash"] != source_hash):
             with st.spinner("Generating slide structure..."):
                 prompt = f"""
 You are an expert presentation designer. Based on the content below, create a PowerPoint structure for the title: '{ppt_title}'.
@@ -192,47 +362,26 @@ Return exactly 5 slides in this format:
     * Bullet 2
 ...
 """
-                slide_structure = model.generate_content(prompt).text
-                st.code(slide_structure)
-
-            if st.button("Generate PowerPoint"):
-                with st.spinner("Creating presentation..."):
-                    prs = Presentation()
-                    prs.slide_width = Inches(13.333)
-                    prs.slide_height = Inches(7.5)
-                    slide = prs.slides.add_slide(prs.slide_layouts[0])
-                    slide.shapes.title.text = ppt_title
-                    slide.placeholders[1].text = f"Generated on {datetime.now().strftime('%d %B %Y')}"
-
-                    slides = re.split(r'\*\*Slide \d+:.*?\*\*', slide_structure)
-                    headers = re.findall(r'\*\*Slide \d+:.*?\*\*', slide_structure)
-                    for i, header in enumerate(headers):
-                        content = slides[i+1] if i+1 < len(slides) else ""
-                        title_match = re.search(r'\*\*Title:\*\*\s*(.*)', content)
-                        title = title_match.group(1).strip() if title_match else f"Slide {i+2}"
-                        bullets = re.findall(r'\*\s+(.*)', content)
-                        slide = prs.slides.add_slide(prs.slide_layouts[1])
-                        slide.shapes.title.text = title
-                        text_frame = slide.placeholders[1].text_frame
-                        text_frame.clear()
-                        for bullet in bullets:
-                            para = text_frame.add_paragraph()
-                            para.text = bullet
-                            para.font.size = Pt(18)
-                            para.font.color.rgb = RGBColor(0, 0, 0)
-                            para.font.name = PPT_FONT
-                            para.alignment = PP_ALIGN.LEFT
-
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as tmp:
-                        prs.save(tmp.name)
-                        with open(tmp.name, "rb") as f:
-                            ppt_bytes = f.read()
-                        st.download_button(
-                            label="📥 Download PowerPoint",
-                            data=ppt_bytes,
-                            file_name=f"{ppt_title.replace(' ', '_')}.pptx",
-                            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                        )
+                state.update({
+                    "slide_structure": model.generate_content(prompt).text,
+                    "ppt_title": ppt_title,
+                    "source_hash": source_hash,
+                    "generated_on": datetime.now().strftime('%d %B %Y')
+                })
+
+        if state["slide_structure"] and state["source_hash"] == source_hash:
+            ppt_title = state["ppt_title"]
+            slide_structure = state["slide_structure"]
+            st.code(slide_structure)
+
+            with st.spinner("Creating presentation..."):
+                ppt_bytes = _build_pptx(ppt_title, slide_structure, state["generated_on"])
+                st.download_button(
+                    label="📥 Download PowerPoint",
+                    data=ppt_bytes,
+                    file_name=f"{ppt_title.replace(' ', '_')}.pptx",
+                    mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+                )
 
 # ==================== MAIN =====================
 if page == "PDF Chat":